@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import re
 import unittest
 
 import whirlpool
@@ -121,5 +122,111 @@ class TestWhirlpool(unittest.TestCase):
             wp.digest_size = 32
 
 
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        whirlpool.enable_stats()
+        whirlpool.reset_stats()
+
+    def tearDown(self):
+        whirlpool.disable_stats()
+        whirlpool.reset_stats()
+
+    def test_disabled(self):
+        whirlpool.disable_stats()
+        wp = whirlpool.new(data['tqbf'])
+        wp.update(data['jotld'])
+        wp.hexdigest()
+        stats = whirlpool.stats()
+        self.assertFalse(stats['enabled'])
+        self.assertEqual(stats['objects_created'], 0)
+        self.assertEqual(stats['update_calls'], 0)
+        self.assertEqual(stats['finalizations'], 0)
+
+    def test_counters(self):
+        wp1 = whirlpool.new(data['tqbf'])
+        wp1.update(data['jotld'])
+        wp2 = wp1.copy()
+        self.assertEqual(wp1.hexdigest(), results['tqbfjotld'])
+        self.assertEqual(digest2hex(wp2.digest()), results['tqbfjotld'])
+
+        stats = whirlpool.stats()
+        self.assertTrue(stats['enabled'])
+        self.assertFalse(stats['timing'])
+        self.assertEqual(stats['objects_created'], 2)
+        self.assertEqual(stats['update_calls'], 1)
+        self.assertEqual(stats['bytes_hashed'], len(data['tqbfjotld']))
+        self.assertEqual(stats['finalizations'], 2)
+        # 43 bytes leave no room for the length, each final takes 2 blocks
+        self.assertEqual(stats['blocks_processed'], 4)
+        self.assertEqual(stats['hash_ns'], 0)
+        sizes = dict(stats['update_sizes'])
+        self.assertEqual(sizes[64], 1)
+        self.assertEqual(sum(sizes.values()), 1)
+
+    def test_blocks_processed(self):
+        wp = whirlpool.new(b'x' * 100)
+        self.assertEqual(whirlpool.stats()['blocks_processed'], 1)
+        wp.digest()
+        # 36 bytes remain, the padding needs an extra block
+        self.assertEqual(whirlpool.stats()['blocks_processed'], 3)
+
+    def test_update_sizes(self):
+        wp = whirlpool.new(b'x' * 10)
+        for size in (0, 16, 17, 1000, 100000):
+            wp.update(b'x' * size)
+        sizes = dict(whirlpool.stats()['update_sizes'])
+        self.assertEqual(sizes[16], 2)
+        self.assertEqual(sizes[64], 1)
+        self.assertEqual(sizes[1024], 1)
+        self.assertEqual(sizes[float('inf')], 1)
+
+    def test_timing(self):
+        whirlpool.enable_stats(timing=True)
+        whirlpool.new(b'x' * 100000).digest()
+        stats = whirlpool.stats()
+        self.assertTrue(stats['timing'])
+        self.assertGreater(stats['hash_ns'], 0)
+
+        hash_ns = stats['hash_ns']
+        line = [l for l in whirlpool.stats_prometheus().splitlines()
+                if l.startswith('whirlpool_hash_seconds_total ')][0]
+        self.assertTrue(re.match(r'^whirlpool_hash_seconds_total \d+\.\d{9}$',
+                                 line), line)
+        self.assertEqual(line.split()[1],
+                         '%d.%09d' % divmod(hash_ns, 1000000000))
+
+    def test_reset(self):
+        whirlpool.new(data['tqbf']).digest()
+        whirlpool.reset_stats()
+        stats = whirlpool.stats()
+        self.assertTrue(stats['enabled'])
+        self.assertEqual(stats['objects_created'], 0)
+        self.assertEqual(stats['bytes_hashed'], 0)
+        self.assertEqual(sum(n for _, n in stats['update_sizes']), 0)
+
+    def test_prometheus(self):
+        whirlpool.new(data['tqbf']).update(b'x' * 100)
+        text = whirlpool.stats_prometheus()
+        self.assertTrue(text.endswith('\n'))
+        lines = text.splitlines()
+        self.assertIn('# TYPE whirlpool_update_calls_total counter', lines)
+        self.assertIn('whirlpool_objects_created_total 1', lines)
+        self.assertIn('whirlpool_bytes_hashed_total 119', lines)
+        self.assertIn('whirlpool_update_size_bytes_bucket{le="64"} 0', lines)
+        self.assertIn('whirlpool_update_size_bytes_bucket{le="256"} 1', lines)
+        self.assertIn('whirlpool_update_size_bytes_bucket{le="+Inf"} 1',
+                      lines)
+        self.assertIn('whirlpool_update_size_bytes_sum 100', lines)
+        self.assertIn('whirlpool_update_size_bytes_count 1', lines)
+
+        text = whirlpool.stats_prometheus(prefix='app_wp')
+        self.assertIn('app_wp_update_calls_total 1', text.splitlines())
+
+        for prefix in ('bad prefix{', '', '1wp', 'wp-1'):
+            with self.assertRaises(ValueError):
+                whirlpool.stats_prometheus(prefix=prefix)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -11,6 +11,11 @@
  */
 
 #include <Python.h>
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
 #include "Whirlpool.c"
 
 #if PY_MAJOR_VERSION >= 3
@@ -63,6 +68,125 @@ static PyTypeObject Whirlpooltype;
 
 #define is_whirlpoolobject(v) ((v)->ob_type == &Whirlpooltype)
 
+
+/* Instrumentation
+ *
+ * Process wide counters, disabled by default. All counters are only
+ * touched while holding the GIL, so plain integers are sufficient.
+ * When disabled the hot path only pays for a single flag test.
+ */
+
+#define STATS_BUCKETS 8
+
+/* Inclusive upper bounds (in bytes) of the update size histogram,
+ * the last bucket counts everything larger. */
+static const Py_ssize_t stats_bounds[STATS_BUCKETS - 1] = {
+    16, 64, 256, 1024, 4096, 16384, 65536
+};
+
+static struct {
+    int enabled;
+    int timing;
+    unsigned PY_LONG_LONG objects_created;
+    unsigned PY_LONG_LONG update_calls;
+    unsigned PY_LONG_LONG update_sizes[STATS_BUCKETS];
+    unsigned PY_LONG_LONG update_bytes;
+    unsigned PY_LONG_LONG bytes_hashed;
+    unsigned PY_LONG_LONG blocks_processed;
+    unsigned PY_LONG_LONG finalizations;
+    unsigned PY_LONG_LONG hash_ns;
+} wpstats;
+
+/* Monotonic clock in nanoseconds, only used when timing is enabled. */
+static unsigned PY_LONG_LONG
+stats_clock(void)
+{
+#ifdef _WIN32
+    static LARGE_INTEGER freq;
+    LARGE_INTEGER now;
+
+    if (freq.QuadPart == 0)
+        QueryPerformanceFrequency(&freq);
+    QueryPerformanceCounter(&now);
+    return (unsigned PY_LONG_LONG)(now.QuadPart / freq.QuadPart)
+          * 1000000000ULL
+        + (unsigned PY_LONG_LONG)(now.QuadPart % freq.QuadPart) * 1000000000ULL
+          / (unsigned PY_LONG_LONG)freq.QuadPart;
+#else
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (unsigned PY_LONG_LONG)ts.tv_sec * 1000000000ULL
+        + (unsigned PY_LONG_LONG)ts.tv_nsec;
+#endif
+}
+
+/* Feed len bytes to the context, keeping the counters up to date. */
+static void
+whirlpool_add(NESSIEstruct *ctx, const unsigned char *buf, Py_ssize_t len)
+{
+    unsigned PY_LONG_LONG start = 0;
+
+    if (!wpstats.enabled) {
+        NESSIEadd(buf, Py_SAFE_DOWNCAST(len, Py_ssize_t, unsigned int) * 8,
+                  ctx);
+        return;
+    }
+
+    wpstats.bytes_hashed += (unsigned PY_LONG_LONG)len;
+    /* NESSIEadd compresses a block each time the buffer fills up. */
+    wpstats.blocks_processed +=
+        ((unsigned PY_LONG_LONG)ctx->bufferBits / 8
+         + (unsigned PY_LONG_LONG)len) / WBLOCKBYTES;
+
+    if (wpstats.timing)
+        start = stats_clock();
+    NESSIEadd(buf, Py_SAFE_DOWNCAST(len, Py_ssize_t, unsigned int) * 8,
+              ctx);
+    if (wpstats.timing)
+        wpstats.hash_ns += stats_clock() - start;
+}
+
+/* Count a call to update() of len bytes in the size histogram. */
+static void
+stats_count_update(Py_ssize_t len)
+{
+    int i;
+
+    wpstats.update_calls++;
+    wpstats.update_bytes += (unsigned PY_LONG_LONG)len;
+    for (i = 0; i < STATS_BUCKETS - 1; i++) {
+        if (len <= stats_bounds[i])
+            break;
+    }
+    wpstats.update_sizes[i]++;
+}
+
+/* Finalize the context, keeping the counters up to date. */
+static void
+whirlpool_finalize(NESSIEstruct *ctx, unsigned char *digest)
+{
+    unsigned PY_LONG_LONG start = 0;
+
+    if (!wpstats.enabled) {
+        NESSIEfinalize(ctx, digest);
+        return;
+    }
+
+    wpstats.finalizations++;
+    /* An extra block is needed when the padding does not leave room
+     * for the length field. */
+    wpstats.blocks_processed +=
+        (ctx->bufferPos + 1 > WBLOCKBYTES - LENGTHBYTES) ? 2 : 1;
+
+    if (wpstats.timing)
+        start = stats_clock();
+    NESSIEfinalize(ctx, digest);
+    if (wpstats.timing)
+        wpstats.hash_ns += stats_clock() - start;
+}
+
+
 static whirlpoolobject *
 newwhirlpoolobject(void)
 {
@@ -73,6 +197,8 @@ newwhirlpoolobject(void)
         return NULL;
 
     NESSIEinit(&wpp->whirlpool); /* actual initialisation */
+    if (wpstats.enabled)
+        wpstats.objects_created++;
     return wpp;
 }
 
@@ -102,9 +228,9 @@ whirlpool_update(whirlpoolobject *self, PyObject *args)
         return NULL;
 #endif
 
-    NESSIEadd((unsigned char*)view.buf,
-              Py_SAFE_DOWNCAST(view.len, Py_ssize_t, unsigned int) * 8,
-              &self->whirlpool);
+    if (wpstats.enabled)
+        stats_count_update(view.len);
+    whirlpool_add(&self->whirlpool, (unsigned char*)view.buf, view.len);
 
     PyBuffer_Release(&view);
     Py_RETURN_NONE;
@@ -126,7 +252,7 @@ whirlpool_digest(whirlpoolobject *self)
 
     /* Make a temporary copy, and perform the final */
     wpContext = self->whirlpool;
-    NESSIEfinalize(&wpContext, digest);
+    whirlpool_finalize(&wpContext, digest);
 
 #if PY_MAJOR_VERSION >= 3
     return PyBytes_FromStringAndSize((const char *)digest, sizeof(digest));
@@ -158,7 +284,7 @@ whirlpool_hexdigest(whirlpoolobject *self)
 
     /* Get the raw (binary) digest value */
     wpContext = self->whirlpool;
-    NESSIEfinalize(&wpContext, digest);
+    whirlpool_finalize(&wpContext, digest);
 
     /* Create a new string */
 #if PY_MAJOR_VERSION >= 3
@@ -280,6 +406,11 @@ the digest of the concatenation of the strings fed to it so far.\n\
 \n\
 Functions:\n\
 new([arg]) -- return a new whirlpool object, initialized with arg if provided\n\
+enable_stats([timing]) -- start collecting usage counters\n\
+disable_stats() -- stop collecting usage counters\n\
+reset_stats() -- reset all usage counters to zero\n\
+stats() -- return the usage counters as a dict\n\
+stats_prometheus([prefix]) -- return the usage counters in Prometheus format\n\
 \n\
 Special Objects:\n\
 WhirlpoolType -- type object for whirlpool objects");
@@ -294,6 +425,11 @@ the digest of the concatenation of the strings fed to it so far.\n\
 \n\
 Functions:\n\
 new([arg]) -- return a new whirlpool object, initialized with arg if provided\n\
+enable_stats([timing]) -- start collecting usage counters\n\
+disable_stats() -- stop collecting usage counters\n\
+reset_stats() -- reset all usage counters to zero\n\
+stats() -- return the usage counters as a dict\n\
+stats_prometheus([prefix]) -- return the usage counters in Prometheus format\n\
 hash(arg) -- DEPRECATED, returns a whirlpool digest of arg, for backward \
 compatibility\n\
 \n\
@@ -371,9 +507,7 @@ whirlpool_new(PyObject *self, PyObject *args)
     }
 
     if (view.len > 0) {
-        NESSIEadd((unsigned char*)view.buf,
-                  Py_SAFE_DOWNCAST(view.len, Py_ssize_t, unsigned int) * 8,
-                  &wpp->whirlpool);
+        whirlpool_add(&wpp->whirlpool, (unsigned char*)view.buf, view.len);
     }
     PyBuffer_Release(&view);
 
@@ -387,10 +521,280 @@ Return a new whirlpool object. If arg is present, the method call update(arg)\n\
 is made.");
 
 
+static PyObject *
+whirlpool_enable_stats(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"timing", NULL};
+    PyObject *timing = Py_False;
+    int flag;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O:enable_stats", kwlist,
+                                     &timing))
+        return NULL;
+    if ((flag = PyObject_IsTrue(timing)) < 0)
+        return NULL;
+
+    wpstats.enabled = 1;
+    wpstats.timing = flag;
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(enable_stats_doc,
+"enable_stats([timing]) -> None\n\
+\n\
+Start collecting usage counters for all whirlpool objects in this\n\
+process. If timing is true, the time spent inside the reference\n\
+implementation's add and finalize is measured too.");
+
+
+static PyObject *
+whirlpool_disable_stats(PyObject *self)
+{
+    wpstats.enabled = 0;
+    wpstats.timing = 0;
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(disable_stats_doc,
+"disable_stats() -> None\n\
+\n\
+Stop collecting usage counters. Values collected so far are kept.");
+
+
+static PyObject *
+whirlpool_reset_stats(PyObject *self)
+{
+    int enabled = wpstats.enabled;
+    int timing = wpstats.timing;
+
+    memset(&wpstats, 0, sizeof(wpstats));
+    wpstats.enabled = enabled;
+    wpstats.timing = timing;
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(reset_stats_doc,
+"reset_stats() -> None\n\
+\n\
+Reset all usage counters to zero.");
+
+
+static PyObject *
+whirlpool_stats(PyObject *self)
+{
+    PyObject *histogram, *bound;
+    int i;
+
+    if ((histogram = PyTuple_New(STATS_BUCKETS)) == NULL)
+        return NULL;
+    for (i = 0; i < STATS_BUCKETS; i++) {
+        PyObject *item;
+
+        if (i < STATS_BUCKETS - 1)
+            bound = PyLong_FromSsize_t(stats_bounds[i]);
+        else
+            bound = PyFloat_FromDouble(Py_HUGE_VAL);
+        if (bound == NULL) {
+            Py_DECREF(histogram);
+            return NULL;
+        }
+        item = Py_BuildValue("(NK)", bound, wpstats.update_sizes[i]);
+        if (item == NULL) {
+            Py_DECREF(histogram);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(histogram, i, item);
+    }
+
+    return Py_BuildValue("{s:O,s:O,s:K,s:K,s:N,s:K,s:K,s:K,s:K}",
+                         "enabled", wpstats.enabled ? Py_True : Py_False,
+                         "timing", wpstats.timing ? Py_True : Py_False,
+                         "objects_created", wpstats.objects_created,
+                         "update_calls", wpstats.update_calls,
+                         "update_sizes", histogram,
+                         "bytes_hashed", wpstats.bytes_hashed,
+                         "blocks_processed", wpstats.blocks_processed,
+                         "finalizations", wpstats.finalizations,
+                         "hash_ns", wpstats.hash_ns);
+}
+
+PyDoc_STRVAR(stats_doc,
+"stats() -> dict\n\
+\n\
+Return the usage counters collected since the last reset_stats().\n\
+update_calls and update_sizes only count calls to the update() method,\n\
+data passed to new() is included in bytes_hashed only. update_sizes is a\n\
+tuple of (upper bound in bytes, count) pairs, the last bound is infinity.\n\
+hash_ns covers all time inside the reference implementation's add and\n\
+finalize, including buffering, and only grows while timing is enabled.");
+
+
+#if PY_MAJOR_VERSION >= 3
+#define STATS_FROMFORMATV PyUnicode_FromFormatV
+#else
+#define STATS_FROMFORMATV PyString_FromFormatV
+#endif
+
+/* Append a formatted line to the list of exposition lines. */
+static int
+stats_append(PyObject *lines, const char *format, ...)
+{
+    PyObject *line;
+    va_list vargs;
+    int rc;
+
+    va_start(vargs, format);
+    line = STATS_FROMFORMATV(format, vargs);
+    va_end(vargs);
+    if (line == NULL)
+        return -1;
+    rc = PyList_Append(lines, line);
+    Py_DECREF(line);
+    return rc;
+}
+
+/* Check name against the metric name grammar [a-zA-Z_:][a-zA-Z0-9_:]*. */
+static int
+stats_valid_name(const char *name)
+{
+    const char *p;
+
+    for (p = name; *p; p++) {
+        if ((*p >= 'a' && *p <= 'z') || (*p >= 'A' && *p <= 'Z') ||
+            *p == '_' || *p == ':')
+            continue;
+        if (p != name && *p >= '0' && *p <= '9')
+            continue;
+        return 0;
+    }
+    return p != name;
+}
+
+/* Append the HELP, TYPE and sample lines of a counter. */
+static int
+stats_counter(PyObject *lines, const char *prefix, const char *name,
+              const char *help, unsigned PY_LONG_LONG value)
+{
+    if (stats_append(lines, "# HELP %s_%s %s", prefix, name, help) < 0 ||
+        stats_append(lines, "# TYPE %s_%s counter", prefix, name) < 0 ||
+        stats_append(lines, "%s_%s %llu", prefix, name, value) < 0)
+        return -1;
+    return 0;
+}
+
+static PyObject *
+whirlpool_stats_prometheus(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"prefix", NULL};
+    const char *prefix = "whirlpool";
+    PyObject *lines, *sep, *retval;
+    unsigned PY_LONG_LONG cumulative = 0;
+    char seconds[64];
+    int i;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|s:stats_prometheus",
+                                     kwlist, &prefix))
+        return NULL;
+    if (!stats_valid_name(prefix)) {
+        PyErr_SetString(PyExc_ValueError,
+                        "prefix is not a valid Prometheus metric name");
+        return NULL;
+    }
+
+    /* Integer math keeps the output exact and independent of LC_NUMERIC. */
+    PyOS_snprintf(seconds, sizeof(seconds), "%llu.%09llu",
+                  wpstats.hash_ns / 1000000000ULL,
+                  wpstats.hash_ns % 1000000000ULL);
+
+    if ((lines = PyList_New(0)) == NULL)
+        return NULL;
+
+    if (stats_counter(lines, prefix, "objects_created_total",
+                      "Whirlpool objects created.",
+                      wpstats.objects_created) < 0 ||
+        stats_counter(lines, prefix, "update_calls_total",
+                      "Calls to update().", wpstats.update_calls) < 0 ||
+        stats_counter(lines, prefix, "bytes_hashed_total",
+                      "Bytes fed to whirlpool objects.",
+                      wpstats.bytes_hashed) < 0 ||
+        stats_counter(lines, prefix, "blocks_processed_total",
+                      "Blocks compressed.", wpstats.blocks_processed) < 0 ||
+        stats_counter(lines, prefix, "finalizations_total",
+                      "Digests finalized.", wpstats.finalizations) < 0)
+        goto error;
+
+    if (stats_append(lines, "# HELP %s_hash_seconds_total "
+                     "Time spent in the reference add and finalize.",
+                     prefix) < 0 ||
+        stats_append(lines, "# TYPE %s_hash_seconds_total counter",
+                     prefix) < 0 ||
+        stats_append(lines, "%s_hash_seconds_total %s",
+                     prefix, seconds) < 0)
+        goto error;
+
+    if (stats_append(lines, "# HELP %s_update_size_bytes "
+                     "Size of update() calls.", prefix) < 0 ||
+        stats_append(lines, "# TYPE %s_update_size_bytes histogram",
+                     prefix) < 0)
+        goto error;
+    for (i = 0; i < STATS_BUCKETS - 1; i++) {
+        cumulative += wpstats.update_sizes[i];
+        if (stats_append(lines, "%s_update_size_bytes_bucket{le=\"%zd\"} %llu",
+                         prefix, stats_bounds[i], cumulative) < 0)
+            goto error;
+    }
+    cumulative += wpstats.update_sizes[i];
+    if (stats_append(lines, "%s_update_size_bytes_bucket{le=\"+Inf\"} %llu",
+                     prefix, cumulative) < 0 ||
+        stats_append(lines, "%s_update_size_bytes_sum %llu",
+                     prefix, wpstats.update_bytes) < 0 ||
+        stats_append(lines, "%s_update_size_bytes_count %llu",
+                     prefix, wpstats.update_calls) < 0 ||
+        stats_append(lines, "") < 0)
+        goto error;
+
+#if PY_MAJOR_VERSION >= 3
+    sep = PyUnicode_FromString("\n");
+#else
+    sep = PyString_FromString("\n");
+#endif
+    if (sep == NULL)
+        goto error;
+#if PY_MAJOR_VERSION >= 3
+    retval = PyUnicode_Join(sep, lines);
+#else
+    retval = _PyString_Join(sep, lines);
+#endif
+    Py_DECREF(sep);
+    Py_DECREF(lines);
+    return retval;
+
+error:
+    Py_DECREF(lines);
+    return NULL;
+}
+
+PyDoc_STRVAR(stats_prometheus_doc,
+"stats_prometheus([prefix]) -> string\n\
+\n\
+Return the usage counters in the Prometheus text exposition format.\n\
+Metric names start with prefix, which defaults to 'whirlpool'.");
+
+
 /* List of functions exported by this module */
 
 static struct PyMethodDef whirlpool_functions[] = {
     {"new",  (PyCFunction)whirlpool_new,  METH_VARARGS, new_doc},
+    {"enable_stats", (PyCFunction)whirlpool_enable_stats,
+     METH_VARARGS | METH_KEYWORDS, enable_stats_doc},
+    {"disable_stats", (PyCFunction)whirlpool_disable_stats,
+     METH_NOARGS, disable_stats_doc},
+    {"reset_stats", (PyCFunction)whirlpool_reset_stats,
+     METH_NOARGS, reset_stats_doc},
+    {"stats", (PyCFunction)whirlpool_stats,
+     METH_NOARGS, stats_doc},
+    {"stats_prometheus", (PyCFunction)whirlpool_stats_prometheus,
+     METH_VARARGS | METH_KEYWORDS, stats_prometheus_doc},
     {NULL, NULL} /* sentinel */
 };
 